@@ -38,10 +38,27 @@ const processArticle = createServerFn({ method: 'POST' })
       throw new Error(errorResponse.error || 'Failed to process article');
     }
 
-    const result = await response.json();
-    return result;
+    // Processing runs in the background on the server; poll until it settles.
+    return pollProcessStatus(data.url);
 });
 
+// Give up after ten minutes of polling at one-second intervals.
+const pollProcessStatus = async (url: string, intervalMs = 1000, maxAttempts = 600) => {
+  for (let attempt = 0; attempt < maxAttempts; attempt++) {
+    await new Promise((resolve) => setTimeout(resolve, intervalMs));
+    const response = await fetch(`${baseUrl}/api/process-article/status?url=${encodeURIComponent(url)}`);
+    const status = await response.json();
+
+    if (!response.ok || status.state === 'error') {
+      throw new Error(status.error || 'Failed to process article');
+    }
+    if (status.state === 'done') {
+      return status;
+    }
+  }
+  throw new Error('Timed out waiting for the article to finish processing');
+};
+
 const ArticleProcess: React.FC = () => {
     const [loading, setLoading] = useState(false);
     const [error, setError] = useState("");
@@ -1,66 +1,129 @@
 import os
-import hashlib
-import json
-import glob
+import sqlite3
+import threading
+from collections import OrderedDict
+import orjson
+import zstandard as zstd
 
 class FileCache:
+    DB_NAME = 'cache.db'
+    MMAP_SIZE = 1 << 30
+    # Values at least this large (in encoded bytes) are stored zstd-compressed.
+    COMPRESS_MIN_SIZE = 4096
+    ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+    # Number of decoded (url, key) values kept in memory in front of the database.
+    MEMORY_CACHE_SIZE = 128
+    # Only the article payloads are memoized; rows such as "status" change while being polled.
+    MEMORY_CACHE_KEYS = frozenset({'title', 'text'})
+
     def __init__(self, cache_dir='cache'):
         self.cache_dir = cache_dir
         os.makedirs(self.cache_dir, exist_ok=True)
 
-    def _get_file_path(self, url: str) -> str:
-        """Generate a file path based on the URL's MD5 hash."""
-        file_name = hashlib.md5(url.encode('utf-8')).hexdigest() + '.json'
-        return os.path.join(self.cache_dir, file_name)
+        # A single SQLite database replaces the per-URL JSON files, so a write is
+        # one indexed row mutation instead of a read-modify-write of the whole file.
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.cache_dir, self.DB_NAME), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        # Serve reads straight from the page cache through an mmap of the database file.
+        self._conn.execute(f'PRAGMA mmap_size={self.MMAP_SIZE}')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS kv(url TEXT, k TEXT, v BLOB, PRIMARY KEY(url, k))')
+        self._conn.commit()
+
+        # zstd (de)compressor objects are not safe for concurrent use; they are only touched under self._lock.
+        self._compressor = zstd.ZstdCompressor(level=3)
+        self._decompressor = zstd.ZstdDecompressor()
+
+        # LRU of decoded values, kept coherent by set/set_many/cleanup within this instance
+        # and by PRAGMA data_version against commits made through other connections (workers).
+        self._mem = OrderedDict()
+        self._data_version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def _remember(self, url: str, key: str, value):
+        """Record a decoded value in the in-memory LRU, evicting the oldest entry when full."""
+        if key not in self.MEMORY_CACHE_KEYS:
+            return
+        self._mem[(url, key)] = value
+        self._mem.move_to_end((url, key))
+        if len(self._mem) > self.MEMORY_CACHE_SIZE:
+            self._mem.popitem(last=False)
+
+    def _encode(self, value) -> bytes:
+        """Serialize a value, compressing large payloads such as article text."""
+        data = orjson.dumps(value)
+        if len(data) >= self.COMPRESS_MIN_SIZE:
+            return self._compressor.compress(data)
+        return data
+
+    def _decode(self, data: bytes):
+        """Inverse of _encode; compressed rows are recognized by the zstd frame magic."""
+        if data[:4] == self.ZSTD_MAGIC:
+            data = self._decompressor.decompress(data)
+        return orjson.loads(data)
 
     def set(self, url: str, key: str, value):
         """
-        Store a value under the given key in the cache file for the URL.
-        
+        Store a value under the given key in the cache for the URL.
+
         Args:
             url (str): The URL serving as the unique key.
             key (str): The property name (e.g., "title", "text").
             value: The JSON-serializable value to store.
         """
-        file_path = self._get_file_path(url)
-        data = {}
-        if os.path.exists(file_path):
-            with open(file_path, 'r') as f:
-                try:
-                    data = json.load(f)
-                except json.JSONDecodeError:
-                    data = {}
-        data['url'] = url  # Always store the URL for reference.
-        data[key] = value
-        with open(file_path, 'w') as f:
-            json.dump(data, f)
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO kv VALUES(?, ?, ?)', (url, key, self._encode(value)))
+            self._remember(url, key, value)
+
+    def set_many(self, url: str, mapping: dict):
+        """
+        Store several key/value pairs for the URL in a single transaction.
+
+        Args:
+            url (str): The URL serving as the unique key.
+            mapping (dict): Property names mapped to JSON-serializable values.
+        """
+        with self._lock, self._conn:
+            rows = [(url, key, self._encode(value)) for key, value in mapping.items()]
+            self._conn.executemany('INSERT OR REPLACE INTO kv VALUES(?, ?, ?)', rows)
+            for key, value in mapping.items():
+                self._remember(url, key, value)
 
     def get(self, url: str, key: str):
         """
-        Retrieve a value by key from the cache file for the URL.
-        
+        Retrieve a value by key from the cache for the URL.
+
         Args:
             url (str): The URL serving as the unique key.
             key (str): The property name to retrieve.
-        
+
         Returns:
             The stored value, or None if not found.
         """
-        file_path = self._get_file_path(url)
-        if os.path.exists(file_path):
-            with open(file_path, 'r') as f:
-                try:
-                    data = json.load(f)
-                    return data.get(key)
-                except json.JSONDecodeError:
-                    return None
-        return None
+        with self._lock:
+            # data_version only moves when another connection commits; drop what it may have changed.
+            data_version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+            if data_version != self._data_version:
+                self._data_version = data_version
+                self._mem.clear()
+            if (url, key) in self._mem:
+                self._mem.move_to_end((url, key))
+                return self._mem[(url, key)]
+            row = self._conn.execute('SELECT v FROM kv WHERE url = ? AND k = ?', (url, key)).fetchone()
+            if row is None:
+                return None
+            try:
+                value = self._decode(row[0])
+            except (orjson.JSONDecodeError, zstd.ZstdError):
+                return None
+            self._remember(url, key, value)
+            return value
 
     def cleanup(self):
-        """Remove all cached files in the cache directory."""
-        files = glob.glob(os.path.join(self.cache_dir, '*.json'))
-        for file in files:
-            try:
-                os.remove(file)
-            except Exception as e:
-                print(f"Error removing file {file}: {e}")
+        """Remove all cached entries."""
+        try:
+            with self._lock, self._conn:
+                self._conn.execute('DELETE FROM kv')
+                self._mem.clear()
+        except sqlite3.Error as e:
+            print(f"Error clearing cache database: {e}")
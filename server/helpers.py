@@ -1,11 +1,20 @@
+import functools
 import hashlib
+import logging
 import os
 import pickle
 import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 from filecache import FileCache
 from flask import Response
 import chromadb
+from chromadb.api.client import SharedSystemClient
+from chromadb.config import Settings
+import orjson
+
+logger = logging.getLogger(__name__)
 
 def initialize_chroma_client(storage_path, reset=False):
     """
@@ -24,27 +33,18 @@ def initialize_chroma_client(storage_path, reset=False):
         else:
             print(f"No existing storage found at: {storage_path}")
     
-    client = chromadb.PersistentClient(path=storage_path)
+    # allow_reset lets clear_all_cache_and_embeddings empty the store without reopening it.
+    client = chromadb.PersistentClient(path=storage_path, settings=Settings(allow_reset=True))
     print(f"Initialized ChromaDB client with storage path: {storage_path}")
     return client
 
-def get_chroma_client(integrator: str):
-    if integrator.lower() == "openai":
-        # Use the environment variable if defined, or default to a specific path.
-        storage_path = os.getenv("CHROMA_STORAGE_PATH", "./openai_embeddings")
-    elif integrator.lower() == "together":
-        storage_path = "./together_embeddings"
-    else:
-        raise ValueError(f"Unknown integrator: {integrator}")
-    
-    return initialize_chroma_client(storage_path)
-
 def clear_all_cache_and_embeddings(
         cache_dir: str, 
         storage_path: str, 
         integrator: str = 'random',  
         base_name: str = "document", 
-        chroma_client=None
+        chroma_client=None,
+        file_cache: FileCache = None
         ):
     """
     Clears the local file cache, the Chroma vector database storage, and all file cache title entries.
@@ -55,30 +55,30 @@ def clear_all_cache_and_embeddings(
         integrator (str): Identifier for the integrator.
         base_name (str): Base name for the document caching.
         chroma_client: The Chroma client instance.
+        file_cache (FileCache): The live FileCache whose entries should be emptied.
+
+    Returns:
+        The reset chroma_client, or a new client opened on the cleared storage path.
     """
-    # Close the existing client connection if it exists.
-    if chroma_client is not None:
-        try:
-            chroma_client.close()  # Make sure your client has a close() method.
-            print("Existing Chroma client connection closed.")
-        except Exception as e:
-            print("Error closing existing Chroma client:", e)
     # Clear file cache.
     if os.path.exists(cache_dir):
-        # Optionally, call the cleanup method of FileCache to remove JSON files.
-        file_cache = FileCache(cache_dir)
-        file_cache.cleanup()
-        
-        # Remove all files and subdirectories within cache_dir.
-        for filename in os.listdir(cache_dir):
-            file_path = os.path.join(cache_dir, filename)
-            try:
-                if os.path.isfile(file_path) or os.path.islink(file_path):
-                    os.unlink(file_path)
-                elif os.path.isdir(file_path):
-                    shutil.rmtree(file_path)
-            except Exception as e:
-                print(f"Failed to delete {file_path}. Reason: {e}")
+        # Empty the FileCache database through the caller's connection; its files stay in place.
+        if file_cache is not None:
+            file_cache.cleanup()
+
+        # Remove all other files and subdirectories within cache_dir.
+        # DirEntry carries the file type from the directory read, so no extra stat per entry.
+        with os.scandir(cache_dir) as entries:
+            for entry in entries:
+                if entry.name.startswith(FileCache.DB_NAME):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path)
+                    else:
+                        os.unlink(entry.path)
+                except Exception as e:
+                    print(f"Failed to delete {entry.path}. Reason: {e}")
         print(f"Cleared file cache contents at {cache_dir}")
     else:
         print(f"No cache directory found at {cache_dir}")
@@ -86,6 +86,15 @@ def clear_all_cache_and_embeddings(
     # Ensure the cache directory still exists.
     os.makedirs(cache_dir, exist_ok=True)
 
+    # Reset the existing client in place when it owns this storage, keeping it warm.
+    if chroma_client is not None and os.path.abspath(chroma_client.get_settings().persist_directory) == os.path.abspath(storage_path):
+        try:
+            chroma_client.reset()
+            print(f"Reset Chroma embeddings at {storage_path}")
+            return chroma_client
+        except Exception as e:
+            print("Error resetting existing Chroma client:", e)
+
     # Clear Chroma storage.
     if os.path.exists(storage_path):
         shutil.rmtree(storage_path)
@@ -96,66 +105,99 @@ def clear_all_cache_and_embeddings(
     # Recreate the storage directory after clearing
     os.makedirs(storage_path, exist_ok=True)
 
+    # Chroma caches one system per path; drop it so the new client does not reuse handles to the removed files.
+    SharedSystemClient.clear_system_cache()
+    return initialize_chroma_client(storage_path)
+
+def json_response(obj, status: int = 200) -> Response:
+    """Serialize obj with orjson, which emits bytes directly, and wrap it in a JSON Response."""
+    return Response(orjson.dumps(obj), status=status, mimetype="application/json")
+
+@functools.lru_cache(maxsize=4096)
 def get_base_name(url: str) -> str:
-    return hashlib.md5(url.encode('utf-8')).hexdigest()
+    # Truncated to 32 hex chars so "{base_name}_{integrator}_embeddings" fits Chroma's 63 character collection name limit.
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()[:32]
 
-def save_to_cache(data, cache_path: str):
+def chunks_digest(chunks: List[str]) -> str:
+    """SHA-256 fingerprint of a chunk list, used to tell whether derived caches are stale."""
+    return hashlib.sha256("\x1f".join(chunks).encode("utf-8")).hexdigest()
+
+def save_to_cache(data, cache_path: str, protocol: int = pickle.HIGHEST_PROTOCOL):
+    # Every cache write (text, chunks, contextual chunks, BM25 index and tokens) goes through here,
+    # so the binary protocol applies everywhere; older .pkl files remain readable by pickle.load.
     with open(cache_path, "wb") as f:
-        pickle.dump(data, f)
+        pickle.dump(data, f, protocol=protocol)
     print(f"Saved cache to {cache_path}")
 
 def load_from_cache(cache_path: str):
-    if os.path.exists(cache_path):
-        print(f"Loading cache from {cache_path}")
+    # Open directly and let a missing file surface as FileNotFoundError, saving a stat() on the hit path.
+    try:
         with open(cache_path, "rb") as f:
+            print(f"Loading cache from {cache_path}")
             return pickle.load(f)
-    print(f"No cache found at {cache_path}")
-    return None
+    except FileNotFoundError:
+        print(f"No cache found at {cache_path}")
+        return None
 
-def normalize(text):
-    return text.strip().lower()
+# Maximum number of inputs each provider accepts in a single embeddings request.
+MAX_EMBEDDING_BATCH = {'together': 128, 'openai': 2048}
+# Shared pool for issuing oversized embedding requests as parallel batches.
+_embedding_executor = ThreadPoolExecutor(max_workers=8)
 
-def generate_embeddings(client, input_texts: List[str], integrator: str, model_api_string: str = None) -> List[List[float]]:
+def generate_embeddings(
+        client, 
+        input_texts: List[str], 
+        integrator: str, 
+        model_api_string: str = None, 
+        batch_size: int = None, 
+        max_retries: int = 3
+        ) -> List[List[float]]:
     """
     Generate embeddings using the specified client and integrator.
+
+    Inputs beyond the batch size are split into batches that are sent concurrently;
+    each batch is retried with exponential backoff so one failure does not discard the rest.
     
     Args:
         input_texts (List[str]): A list of input texts.
         model_api_string (str): The model identifier for the embedding model.
         client: The client instance (either Together or OpenAI).
         integrator (str): The API provider to use. Accepts 'together' or 'openai'. Default is 'together'.
+        batch_size (int): Inputs per request. Defaults to, and is capped by, the provider's limit.
+        max_retries (int): Attempts per batch before the error is raised.
         
     Returns:
         List[List[float]]: A list of embeddings corresponding to the input texts.
     """
-    embeddings = []
-    
-    if integrator.lower() == 'together':
-        outputs = client.embeddings.create(
-            input=input_texts,
-            model=model_api_string or "BAAI/bge-large-en-v1.5",
-        )
-        for i, data in enumerate(outputs.data):
-            embedding = data.embedding
-            snippet = input_texts[i][:50] + "..." if len(input_texts[i]) > 50 else input_texts[i]
-            print(f"[DEBUG][Together] Embedding {i + 1}/{len(outputs.data)} created for input: '{snippet}' (length: {len(embedding)})")
-            embeddings.append(embedding)
-            
-    elif integrator.lower() == 'openai':
+    if integrator == 'together':
+        model = model_api_string or "BAAI/bge-large-en-v1.5"
+    elif integrator == 'openai':
         # For OpenAI, assume the client follows the OpenAI API structure.
-        outputs = client.embeddings.create(
-            input=input_texts,
-            model=model_api_string or "text-embedding-ada-002",
-        )
-        for i, data in enumerate(outputs.data):
-            embedding = data.embedding
-            snippet = input_texts[i][:50] + "..." if len(input_texts[i]) > 50 else input_texts[i]
-            print(f"[DEBUG][OpenAI] Embedding {i + 1}/{len(outputs.data)} created for input: '{snippet}' (length: {len(embedding)})")
-            embeddings.append(embedding)
-            
+        model = model_api_string or "text-embedding-ada-002"
     else:
         raise ValueError("Unsupported provider. Choose 'together' or 'openai'.")
+
+    def embed_batch(batch: List[str]) -> List[List[float]]:
+        for attempt in range(max_retries):
+            try:
+                outputs = client.embeddings.create(input=batch, model=model)
+                return [data.embedding for data in outputs.data]
+            except Exception as e:
+                if attempt == max_retries - 1:
+                    raise
+                delay = 0.5 * 2 ** attempt
+                print(f"Embedding batch failed ({e}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    batch_size = min(batch_size or MAX_EMBEDDING_BATCH[integrator], MAX_EMBEDDING_BATCH[integrator])
+    if len(input_texts) <= batch_size:
+        embeddings = embed_batch(input_texts)
+    else:
+        batches = [input_texts[i:i + batch_size] for i in range(0, len(input_texts), batch_size)]
+        # map preserves batch order, so embeddings stay aligned with input_texts.
+        embeddings = [embedding for batch in _embedding_executor.map(embed_batch, batches) for embedding in batch]
     
+    logger.debug("[%s] Created %d embeddings", integrator, len(embeddings))
     return embeddings
 
 
@@ -173,9 +215,9 @@ def generate_context(client, prompt: str, integrator: str = 'together', model: s
     Returns:
         str: The generated context.
     """
-    if integrator.lower() == 'together':
+    if integrator == 'together':
         default_model = "meta-llama/Llama-3.2-3B-Instruct-Turbo"
-    elif integrator.lower() == 'openai':
+    elif integrator == 'openai':
         default_model = "gpt-3.5-turbo"
     else:
         raise ValueError("Unsupported integrator. Please choose 'together' or 'openai'.")
@@ -199,10 +241,14 @@ def rerank_documents_togetherai(client, documents: List[str], query: str, top_n:
         documents=documents,
         top_n=top_n
     )
-    retrieved_chunks = ""
-    for result in response.results:
-        retrieved_chunks += documents[result.index] + '\n\n'
-    return retrieved_chunks
+    return '\n\n'.join(documents[result.index] for result in response.results)
+
+# Constant parts of the OpenAI rerank prompt, built once at import time.
+_RERANK_HEAD = "You are a helpful assistant that ranks documents by their relevance to a given query.\n\n"
+_RERANK_FOOT_TMPL = (
+    "Please rank the documents by relevance to the query and return the top {n} document texts, "
+    "each separated by a newline. Do not include numbers or extra commentary."
+)
 
 def rerank_documents_openai(client, documents: List[str], query: str, top_n: int = 5) -> str:
     """
@@ -212,16 +258,9 @@ def rerank_documents_openai(client, documents: List[str], query: str, top_n: int
     """
     # Build a prompt that presents the query and candidate documents.
     prompt = (
-        "You are a helpful assistant that ranks documents by their relevance to a given query.\n\n"
-        f"Query: {query}\n\n"
-        "Here are the candidate documents:\n"
-    )
-    for i, doc in enumerate(documents, start=1):
-        prompt += f"{i}. {doc}\n\n"
-    
-    prompt += (
-        f"Please rank the documents by relevance to the query and return the top {top_n} document texts, "
-        "each separated by a newline. Do not include numbers or extra commentary."
+        f"{_RERANK_HEAD}Query: {query}\n\nHere are the candidate documents:\n"
+        + "".join(f"{i}. {doc}\n\n" for i, doc in enumerate(documents, start=1))
+        + _RERANK_FOOT_TMPL.format(n=top_n)
     )
     
     response = client.chat.completions.create(
@@ -235,24 +274,13 @@ def rerank_documents_openai(client, documents: List[str], query: str, top_n: int
     return response.choices[0].message.content
   
 def stream_generator(response_iterator, url='', chat_histories=None):
-    """Stream OpenAI response while storing it in chat history."""
-    full_response = ""
-    
+    """Stream OpenAI response deltas as they arrive."""
+    # Chat history is not persisted (see create_chat), so deltas are yielded
+    # without accumulating the full response.
     for chunk in response_iterator:
-        delta = chunk.choices[0].delta
-        if delta.content is not None:
-            full_response += delta.content
-            print(delta.content, end="", flush=True)
-            yield delta.content
-
-    # # Ensure there is a history for this session.
-    # if url not in chat_histories:
-    #     chat_histories[url] = []
-        
-    # # Store final response in chat history.
-    # chat_histories[url].append({"role": "assistant", "content": full_response})
-    # # Keep only the last 5 entries.
-    # chat_histories[url] = chat_histories[url][-5:]
+        content = chunk.choices[0].delta.content
+        if content is not None:
+            yield content
 
 def create_chat(client, query, retrieved_chunks, integrator: str, model: str = None, temperature: float = 0.3, url: str = '', chat_histories: dict = None):
     """
@@ -276,9 +304,9 @@ def create_chat(client, query, retrieved_chunks, integrator: str, model: str = N
         chat_histories = {}
 
     # Set default models based on integrator.
-    if integrator.lower() == 'openai':
+    if integrator == 'openai':
         default_model = "gpt-4o-mini"
-    elif integrator.lower() == 'together':
+    elif integrator == 'together':
         default_model = "meta-llama/Meta-Llama-3.1-405B-Instruct-Turbo"
     else:
         raise ValueError("Unsupported integrator. Choose 'openai' or 'together'.")
@@ -311,13 +339,10 @@ def create_chat(client, query, retrieved_chunks, integrator: str, model: str = N
 
 def stream_generator_responses_api(response):
     """Generator that yields streaming text from the response."""
-    full_text = ""
     for event in response:
         # Check if the event is a delta event with text.
         if event.type == "response.output_text.delta":
-            delta = event.delta  # the incremental text content
-            full_text += delta
-            yield delta  # yield incremental updates (or you can yield full_text if desired)
+            yield event.delta  # the incremental text content
         # You can handle annotation events if needed.
         elif event.type == "response.completed":
             break
@@ -365,10 +390,5 @@ def suggest_similar_articles(client, title_text: str, search_context_size: str =
         stream=True
     )
 
-    def generate():
-        for delta in stream_generator_responses_api(stream):
-            print(delta, end="", flush=True)
-            yield delta
-    
-    return Response(generate(), mimetype="text/plain")
+    return Response(stream_generator_responses_api(stream), mimetype="text/plain")
 
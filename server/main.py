@@ -1,9 +1,13 @@
+import importlib.util
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from filecache import FileCache
 from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
+from werkzeug.exceptions import NotFound
 from asgiref.wsgi import WsgiToAsgi
-from helpers import clear_all_cache_and_embeddings, create_chat, get_base_name, get_chroma_client, initialize_chroma_client, suggest_similar_articles
+from helpers import clear_all_cache_and_embeddings, create_chat, get_base_name, initialize_chroma_client, json_response, suggest_similar_articles
 from processor import TextProcessor
 from retriever import Retriever
 from scraper import Scraper
@@ -34,9 +38,22 @@ if openai_api_key and openai_api_key.strip():
 else:
     openai_responses_client = None  # Later, endpoints can return an error if an OpenAI integrator is requested
 
+# Optionally embed retrieval queries in-process (requires sentence-transformers; Together integrator only).
+USE_LOCAL_QUERY_EMBEDDER = os.environ.get("LOCAL_QUERY_EMBEDDER", "").strip().lower() in ("1", "true", "yes")
+# The model is loaded lazily on the first query, so check its dependencies now rather than failing every chat request.
+if USE_LOCAL_QUERY_EMBEDDER:
+    missing = [name for name in ("sentence_transformers", "torch") if importlib.util.find_spec(name) is None]
+    if missing:
+        raise Exception(f"Error: LOCAL_QUERY_EMBEDDER is set but {', '.join(missing)} is not installed.")
+
+# Dispatch table from canonical (lowercased) integrator name to its client.
+CLIENTS = {"together": together_client, "openai": openai_responses_client}
+
 # Instantiate chroma storage path
 STORAGE_PATH = os.getenv("CHROMA_STORAGE_PATH", "./together_embeddings")
-chroma_client = None
+# Open the persistent client once at startup; clear_cache swaps it under the lock.
+chroma_client = initialize_chroma_client(STORAGE_PATH)
+chroma_lock = threading.Lock()
 
 # Create a Flask app.
 app = Flask(f"article_scraper")
@@ -57,35 +74,60 @@ IMAGES_DIR = os.path.join(os.getcwd(), "images")
 @app.route("/api/article-image", methods=["GET"])
 def get_article_image():
     image_filename = "articleImage.png"
-    image_path = os.path.join(IMAGES_DIR, image_filename)
-    
-    if not os.path.exists(image_path):
-        return jsonify({"error": "Image not found"}), 404
-    
-    # Serve the image file.
-    return send_from_directory(IMAGES_DIR, image_filename)
 
-@app.route("/api/process-article", methods=["POST"])
-def process_article_endpoint():
-    global chroma_client
-    data = request.json
-    url = data.get("url")
-    chunk_size = data.get("chunk_size")
-    integrator = data.get("integrator", "together").lower()
-    
-    if not url:
-        return jsonify({"error": "URL is required"}), 400
-    
-    # Validate integrator.
-    if integrator not in ["together", "openai"]:
-        return jsonify({"error": "Invalid integrator specified."}), 400
+    # Serve the image file; send_from_directory raises NotFound itself, so no separate stat is needed.
+    try:
+        resp = send_from_directory(IMAGES_DIR, image_filename, conditional=True)
+    except NotFound:
+        return jsonify({"error": "Image not found"}), 404
 
+    # The client requests the image with a cache-busting timestamp, so each URL can be cached outright.
+    resp.cache_control.public = True
+    resp.cache_control.max_age = 86400
+    return resp
+
+# Article processing runs off the request thread; progress is tracked under the "status" cache key.
+process_executor = ThreadPoolExecutor(max_workers=4)
+# url -> Future for jobs submitted by this worker; entries are dropped on completion.
+process_jobs = {}
+process_jobs_lock = threading.Lock()
+
+def _forget_job(url: str, future):
+    """Drop a finished job, unless the URL has since been resubmitted."""
+    with process_jobs_lock:
+        if process_jobs.get(url) is future:
+            del process_jobs[url]
+
+def _pid_alive(pid: int) -> bool:
+    """Whether another worker process that may own a job is still running."""
+    if os.name != "posix":
+        return True  # Signal 0 is not a liveness probe on Windows; let the client-side poll cap apply.
     try:
-        # Initialize the global chroma_client if it hasn't been already.
-        if chroma_client is None:
-            chroma_client = get_chroma_client(integrator)
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _job_is_live(url: str, status: dict) -> bool:
+    """
+    Whether a "processing" status row is backed by a job that is still running,
+    in this worker or in the worker whose pid the row records. Call with process_jobs_lock held.
+    """
+    pid = status.get("pid")
+    if pid != os.getpid():
+        return pid is not None and _pid_alive(pid)
+    job = process_jobs.get(url)
+    return job is not None and not job.done()
+
+def process_article_job(url: str, integrator: str, chunk_size):
+    """Scrape, chunk, contextualize and embed an article, recording the outcome in the file cache."""
+    try:
+        with chroma_lock:
+            current_chroma_client = chroma_client
         # Decide which client to use.
-        used_client = together_client if integrator.lower() == "together" else openai_responses_client
+        used_client = CLIENTS[integrator]
 
         # Scrape the article.
         scraper = Scraper()
@@ -94,70 +136,127 @@ def process_article_endpoint():
         article_text = document["article_text"]
 
         if not article_text:
-            return jsonify({"error": "Failed to retrieve article text."}), 500
-
+            file_cache.set(url, "status", {"state": "error", "error": "Failed to retrieve article text."})
+            return
 
         # Compute a unique base name for this URL.
         base_name = get_base_name(url)
 
         # Cache the article title and text.
-        file_cache.set(url, "title", article_title)
-        file_cache.set(url, "text", article_text)
+        file_cache.set_many(url, {"title": article_title, "text": article_text})
 
         # Process the article.
         # The TextProcessor will load cached text, chunks, and contextual_chunks if available.
-        processor = TextProcessor(article_text, used_client, chroma_client, integrator, base_name, chunk_size=chunk_size)
-        processor.process() 
+        processor = TextProcessor(article_text, used_client, current_chroma_client, integrator, base_name, chunk_size=chunk_size)
+        processor.process()
+
+        file_cache.set(url, "status", {"state": "done", "articleTitle": article_title})
 
-        return jsonify({"message": "Article has been processed successfully.", "articleTitle": article_title }), 200
-    
     except Exception as e:
         error_message = f"Server error during article processing. Details: {str(e)}"
         print(f"Error processing article: {error_message}")
-        return jsonify({"error": error_message}), 500   
+        file_cache.set(url, "status", {"state": "error", "error": error_message})
+
+@app.route("/api/process-article", methods=["POST"])
+def process_article_endpoint():
+    """
+    Queue an article for processing and return immediately.
+
+    Poll /api/process-article/status with the same URL to find out when it is done.
+    """
+    data = request.json
+    url = data.get("url")
+    chunk_size = data.get("chunk_size")
+    integrator = (data.get("integrator", "together") or "together").lower()
+    
+    if not url:
+        return json_response({"error": "URL is required"}, 400)
+    
+    # Validate integrator.
+    if integrator not in CLIENTS:
+        return json_response({"error": "Invalid integrator specified."}, 400)
+
+    with process_jobs_lock:
+        # The status row is shared by all workers, so it also catches jobs running in another one.
+        status = file_cache.get(url, "status")
+        if status is not None and status.get("state") == "processing" and _job_is_live(url, status):
+            if (status.get("integrator"), status.get("chunk_size")) != (integrator, chunk_size):
+                return json_response({"error": "Article is already being processed with a different integrator or chunk size."}, 409)
+            return json_response({"message": "Article is already being processed.", "state": "processing"}, 202)
+
+        # The owning worker's pid lets any worker tell a live job from one lost to a restart.
+        file_cache.set(url, "status", {"state": "processing", "pid": os.getpid(), "integrator": integrator, "chunk_size": chunk_size})
+        future = process_executor.submit(process_article_job, url, integrator, chunk_size)
+        process_jobs[url] = future
+    # Registered outside the lock: the callback runs inline if the job has already finished.
+    future.add_done_callback(lambda f: _forget_job(url, f))
+    return json_response({"message": "Article processing has started.", "state": "processing"}, 202)
+
+@app.route("/api/process-article/status", methods=["GET"])
+def process_article_status_endpoint():
+    """Report the processing state ("processing", "done" or "error") of the article at ?url=."""
+    url = request.args.get("url")
+    if not url:
+        return json_response({"error": "URL is required"}, 400)
+
+    status = file_cache.get(url, "status")
+    if status is None:
+        return json_response({"error": "Article has not been submitted for processing."}, 404)
+    if status.get("state") == "processing":
+        with process_jobs_lock:
+            live = _job_is_live(url, status)
+            if not live:
+                # A job records its outcome before its Future completes, so a job that finished
+                # after the first read has already replaced the row; only a lost job leaves it in place.
+                status = file_cache.get(url, "status") or {}
+                live = status.get("state") == "processing" and _job_is_live(url, status)
+        if live:
+            return json_response({"state": "processing"}, 200)
+        if status.get("state") in (None, "processing"):
+            return json_response({"state": "error", "error": "Article processing was interrupted. Please submit it again."}, 200)
+    return json_response(status, 200)
 
 # Global chat history dictionary.
 chat_histories = {}
 
 @app.route("/api/retrieve-chat", methods=["POST"])
 def retrieve_chat_endpoint():
-    global chroma_client
     data = request.json
     url = data.get("url")
     query = data.get("query")
     model = data.get("model")
-    integrator = data.get("integrator", "together").lower()
+    integrator = (data.get("integrator", "together") or "together").lower()
     
     if not url or not query:
-        return jsonify({"error": "URL and query are required"}), 400
+        return json_response({"error": "URL and query are required"}, 400)
 
-    if integrator not in ["together", "openai"]:
-        return jsonify({"error": "Invalid integrator specified."}), 400
+    if integrator not in CLIENTS:
+        return json_response({"error": "Invalid integrator specified."}, 400)
     
     try:
-        # Initialize the global chroma_client if it hasn't been already.
-        if chroma_client is None:
-            chroma_client = get_chroma_client(integrator)
+        with chroma_lock:
+            current_chroma_client = chroma_client
 
-        used_client = together_client if integrator.lower() == "together" else openai_responses_client
+        used_client = CLIENTS[integrator]
 
         # Compute the same unique base name for this URL.
         base_name = get_base_name(url)
 
         article_text = file_cache.get(url, "text")
         if not article_text:
-            return jsonify({"error": "Article text not found in cache. Please process the article first."}), 404
+            return json_response({"error": "Article text not found in cache. Please process the article first."}, 404)
 
-        processor = TextProcessor(article_text, used_client, chroma_client, integrator, base_name)
+        processor = TextProcessor(article_text, used_client, current_chroma_client, integrator, base_name)
         processed_data = processor.process()
 
         retriever = Retriever(
             used_client,
-            chroma_client,
+            current_chroma_client,
             processed_data["contextual_chunks"],
             processed_data["collection"],
             integrator,
-            base_name
+            base_name,
+            local_embedder=USE_LOCAL_QUERY_EMBEDDER
         )
 
         retrieved_chunks = retriever.retrieve(query)
@@ -175,7 +274,7 @@ def retrieve_chat_endpoint():
     
     except Exception as e:
         print(f"Error during retrieval: {e}")
-        return jsonify({"error": "Internal server error during chat retrieval."}), 500
+        return json_response({"error": "Internal server error during chat retrieval."}, 500)
 
 @app.route("/api/suggest-articles", methods=["POST"])
 def suggest_articles_endpoint():
@@ -188,17 +287,17 @@ def suggest_articles_endpoint():
     """
     data = request.json
     url = data.get("url")
-    integrator = data.get("integrator", "together")
+    integrator = (data.get("integrator", "together") or "together").lower()
     
     if not url:
         return jsonify({"error": "URL is required"}), 400
     
     # Validate integrator.
-    if integrator not in ["together", "openai"]:
+    if integrator not in CLIENTS:
         return jsonify({"error": "Invalid integrator specified."}), 400
         
     try:
-        used_client = together_client if integrator.lower() == "together" else openai_responses_client
+        used_client = CLIENTS[integrator]
         
         cached_title = file_cache.get(url, "title")
         print('cached_title ---->', cached_title)
@@ -218,18 +317,15 @@ def suggest_articles_endpoint():
 def clear_cache():
     global chroma_client
     data = request.get_json()
-    integrator = data.get("integrator", "together").lower()
+    integrator = (data.get("integrator", "together") or "together").lower()
 
-    if integrator == "openai":
-        storage_path_to_use = STORAGE_PATH
-    elif integrator == "together":
-        storage_path_to_use = "./together_embeddings"
-    else:
+    if integrator not in CLIENTS:
         return jsonify({"error": f"Unknown integrator: {integrator}"}), 400
     
     try:
-        # Clear caches and reinitialize a new client.
-        chroma_client = clear_all_cache_and_embeddings("cache", storage_path_to_use, integrator, chroma_client=chroma_client)
+        # Clear caches and reinitialize a new client; both integrators share the store at STORAGE_PATH.
+        with chroma_lock:
+            chroma_client = clear_all_cache_and_embeddings("cache", STORAGE_PATH, integrator, chroma_client=chroma_client, file_cache=file_cache)
         # Optionally, log or return information about the new client.
         return jsonify({"message": "Cache and embeddings cleared."}), 200
     except Exception as e:
@@ -1,10 +1,28 @@
 import math
 import os
-from typing import List
-import nltk
-nltk.download('punkt_tab', quiet=True)
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterator, List
+try:
+    import blingfire
+except (ImportError, OSError):  # Fall back to NLTK's pure-Python Punkt tokenizer, loaded on first use.
+    # OSError: the wheel bundles an x86-64 shared library that ctypes cannot load on other architectures.
+    blingfire = None
 from context import CONTEXTUAL_RAG_PROMPT
-from helpers import generate_context, load_from_cache, save_to_cache, generate_embeddings
+from helpers import chunks_digest, generate_context, load_from_cache, save_to_cache, generate_embeddings
+
+# Set once the NLTK Punkt model has been downloaded in this process.
+_PUNKT_READY = False
+
+def _split_sentences(text: str) -> List[str]:
+    """Split text into sentences with BlingFire when installed, otherwise NLTK."""
+    global _PUNKT_READY
+    if blingfire is not None:
+        return blingfire.text_to_sentences(text).split("\n")
+    import nltk
+    if not _PUNKT_READY:
+        nltk.download('punkt_tab', quiet=True)
+        _PUNKT_READY = True
+    return nltk.sent_tokenize(text)
 
 class TextProcessor:
     """
@@ -23,13 +41,17 @@ class TextProcessor:
             integrator: str = "together", 
             base_name: str = "document", 
             cache_dir: str = "cache",
-            chunk_size: str = "100"
+            chunk_size: str = "100",
+            context_concurrency: int = 16,
+            embed_batch_size: int = 64
             ):
         self.client = client
         self.chroma_client = chroma_client
         self.integrator = integrator
         self.base_name = base_name
         self.cache_dir = cache_dir
+        self.context_concurrency = max(1, context_concurrency)
+        self.embed_batch_size = max(1, embed_batch_size)
         try:
             self.chunk_size = int(chunk_size)
         except (ValueError, TypeError):
@@ -67,24 +89,20 @@ class TextProcessor:
         if chunk_size <= overlap:
             raise ValueError("chunk_size must be greater than overlap.")
         
-        # Split the document into sentences.
-        sentences = nltk.sent_tokenize(self.document)
-        token_count = lambda text: len(text.split())
+        # Split the document into sentences, tokenizing each one only once.
+        sentence_tokens = [sentence.split() for sentence in _split_sentences(self.document)]
         
         chunks = []
         current_tokens = []  # This will store tokens (words) for the current chunk.
         
-        for sentence in sentences:
-            # Prepare a potential chunk by joining current tokens with the new sentence.
-            potential_chunk = " ".join(current_tokens + [sentence])
-            if token_count(potential_chunk) > chunk_size and current_tokens:
-                # Commit the current chunk.
-                chunk_text = " ".join(current_tokens)
-                chunks.append(chunk_text)
+        for tokens in sentence_tokens:
+            # Commit the current chunk if adding this sentence would exceed chunk_size.
+            if current_tokens and len(current_tokens) + len(tokens) > chunk_size:
+                chunks.append(" ".join(current_tokens))
                 # Retain the last 'overlap' tokens for context.
-                current_tokens = chunk_text.split()[-overlap:] if overlap > 0 else []
+                current_tokens = current_tokens[-overlap:] if overlap > 0 else []
             # Add the current sentence (as tokens) to the current chunk.
-            current_tokens.extend(sentence.split())
+            current_tokens.extend(tokens)
         
         # Append any remaining tokens as the final chunk.
         if current_tokens:
@@ -92,38 +110,56 @@ class TextProcessor:
         
         return chunks
 
-    def _generate_prompts(self, chunks: List[str]) -> List[str]:
-        """Generate prompts for each chunk using a global prompt template."""
-        return [
-            CONTEXTUAL_RAG_PROMPT.format(WHOLE_DOCUMENT=self.document, CHUNK_CONTENT=chunk)
-            for chunk in chunks
-        ]
+    def _generate_prompts(self, chunks: List[str]) -> Iterator[str]:
+        """
+        Lazily generate prompts for each chunk using a global prompt template.
+        Every prompt embeds the whole document, so they are produced one at a time rather than as a list.
+        """
+        for chunk in chunks:
+            yield CONTEXTUAL_RAG_PROMPT.format(WHOLE_DOCUMENT=self.document, CHUNK_CONTENT=chunk)
 
-    def _generate_contextual_chunks(self, prompts: List[str], chunks: List[str]) -> List[str]:
-        """Generate contextual chunks by fetching context from the client."""
-        contextual_chunks = []
-        for i, (prompt, chunk) in enumerate(zip(prompts, chunks)):
-            try:
-                context = generate_context(self.client, prompt, integrator=self.integrator)
-                print(f"Context for chunk {i}: {context}")  # Consider logging instead
-                contextual_chunks.append(f"{context} {chunk}")
-            except Exception as e:
-                print(f"Error generating context for chunk {i}: {e}")
-                # Optionally append just the chunk without context or skip
-                contextual_chunks.append(chunk)
+    def _contextualize_chunk(self, i: int, prompt: str, chunk: str) -> str:
+        """Prefix a single chunk with its generated context, falling back to the bare chunk on error."""
+        try:
+            context = generate_context(self.client, prompt, integrator=self.integrator)
+            print(f"Context for chunk {i}: {context}")  # Consider logging instead
+            return f"{context} {chunk}"
+        except Exception as e:
+            print(f"Error generating context for chunk {i}: {e}")
+            # Optionally append just the chunk without context or skip
+            return chunk
+
+    def _generate_contextual_chunks(self, chunks: List[str]) -> List[str]:
+        """
+        Generate contextual chunks by fetching context from the client.
+        The clients are synchronous, so up to 'context_concurrency' requests run on a thread pool.
+        Prompts are built only as slots free up, so at most that many live in memory at once;
+        results are written back by position to keep chunk order.
+        """
+        contextual_chunks = [None] * len(chunks)
+        pending = {}
+        with ThreadPoolExecutor(max_workers=self.context_concurrency) as executor:
+            for i, (prompt, chunk) in enumerate(zip(self._generate_prompts(chunks), chunks)):
+                if len(pending) >= self.context_concurrency:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        contextual_chunks[pending.pop(future)] = future.result()
+                pending[executor.submit(self._contextualize_chunk, i, prompt, chunk)] = i
+            for future in wait(pending).done:
+                contextual_chunks[pending[future]] = future.result()
         return contextual_chunks
 
-    def _store_embeddings_in_chroma(self, collection_name: str, contextual_chunks: List[str], contextual_embeddings: List[List[float]]):
+    def _store_embeddings_in_chroma(self, collection, contextual_chunks: List[str], contextual_embeddings: List[List[float]]):
         """
-        Upsert embeddings into a Chroma collection.
+        Upsert embeddings into the given Chroma collection.
         """
         # Validate inputs.
         if len(contextual_chunks) != len(contextual_embeddings):
             raise ValueError("The number of chunks and embeddings must be the same.")
 
-        collection = self.chroma_client.get_or_create_collection(name=collection_name)
         ids = [f"chunk_{i}" for i in range(len(contextual_chunks))]
-        metadatas = [{"text": chunk} for chunk in contextual_chunks]
+        # The chunk text is already stored as the document; metadata only carries its position.
+        metadatas = [{"idx": i} for i in range(len(contextual_chunks))]
 
         collection.upsert(
             ids=ids,
@@ -132,7 +168,7 @@ class TextProcessor:
             metadatas=metadatas,
         )
         
-        print(f"Upserted {len(contextual_chunks)} embeddings into Chroma collection '{collection_name}'")
+        print(f"Upserted {len(contextual_chunks)} embeddings into Chroma collection '{collection.name}'")
         return collection
     
         # === Public Wrapper Methods for Granular Control ===
@@ -154,10 +190,9 @@ class TextProcessor:
         """Public method to generate (or load) contextual chunks based on prompts."""
         if not self.chunks:
             raise ValueError("Chunks not available; please generate chunks first.")
-        prompts = self._generate_prompts(self.chunks)
         self.contextual_chunks = load_from_cache(self.contextual_chunks_cache)
         if not self.contextual_chunks:
-            self.contextual_chunks = self._generate_contextual_chunks(prompts, self.chunks)
+            self.contextual_chunks = self._generate_contextual_chunks(self.chunks)
             save_to_cache(self.contextual_chunks, self.contextual_chunks_cache)
         return self.contextual_chunks
 
@@ -167,13 +202,29 @@ class TextProcessor:
             raise ValueError("Contextual chunks not available; please generate them first.")
         collection_name = f"{self.base_name}_{self.integrator}_embeddings"
         self.collection = self.chroma_client.get_or_create_collection(name=collection_name)
-        if self.collection.count() == 0:
+        # Fingerprint the chunk contents so an up-to-date collection is reused and a stale one is rebuilt.
+        digest = chunks_digest(self.contextual_chunks)
+        metadata = self.collection.metadata or {}
+        count = self.collection.count()
+        up_to_date = count == len(self.contextual_chunks) and metadata.get("chunks_hash", digest) == digest
+        if not up_to_date:
+            if count:
+                print(f"Contextual chunks changed; rebuilding Chroma collection '{collection_name}'")
+                self.collection.delete(ids=self.collection.get(include=[])["ids"])
             try:
-                contextual_embeddings = generate_embeddings(self.client, self.contextual_chunks, integrator=self.integrator)
+                contextual_embeddings = generate_embeddings(
+                    self.client, 
+                    self.contextual_chunks, 
+                    integrator=self.integrator, 
+                    batch_size=self.embed_batch_size
+                    )
             except Exception as e:
                 print(f"Error in generating embeddings: {e}")
                 raise
-            self.collection = self._store_embeddings_in_chroma(collection_name, self.contextual_chunks, contextual_embeddings)
+            self._store_embeddings_in_chroma(self.collection, self.contextual_chunks, contextual_embeddings)
+            # Chroma rejects changes to hnsw:* settings after creation, so only carry over the other keys.
+            user_metadata = {key: value for key, value in metadata.items() if not key.startswith("hnsw:")}
+            self.collection.modify(metadata={**user_metadata, "chunks_hash": digest})
         else:
             print(f"Using existing embeddings in Chroma collection '{collection_name}'")
         return self.collection
@@ -192,5 +243,7 @@ class TextProcessor:
     def cleanup(self):
         """Remove cached files for this article."""
         for cache_file in [self.text_cache, self.chunks_cache, self.contextual_chunks_cache]:
-            if os.path.exists(cache_file):
-                os.remove(cache_file)
\ No newline at end of file
+            try:
+                os.remove(cache_file)
+            except FileNotFoundError:
+                pass
\ No newline at end of file
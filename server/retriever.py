@@ -1,8 +1,48 @@
+import functools
 import os
 from typing import List, Tuple
 import bm25s
-from collections import defaultdict
-from helpers import load_from_cache, normalize, rerank_documents_openai, rerank_documents_togetherai, save_to_cache, generate_embeddings
+import numpy as np
+from helpers import chunks_digest, load_from_cache, rerank_documents_openai, rerank_documents_togetherai, save_to_cache, generate_embeddings
+
+@functools.lru_cache(maxsize=1024)
+def _embed_query(client, query: str, integrator: str) -> List[float]:
+    """
+    Embed a single query string. Retrievers are created per request, so the cache lives at
+    module level, keyed on (client, query, integrator), to let repeat queries skip the API call.
+    """
+    return generate_embeddings(client, [query], integrator=integrator)[0]
+
+# Model behind Together's default embeddings, so locally embedded queries match the stored vectors.
+LOCAL_EMBEDDING_MODEL = "BAAI/bge-large-en-v1.5"
+
+@functools.lru_cache(maxsize=1)
+def _load_local_embedder():
+    """
+    Load the in-process query embedder once per process (requires sentence-transformers and torch).
+    Runs in bfloat16 on a GPU when one is available, otherwise in float32 on the CPU.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    if torch.cuda.is_available():
+        return SentenceTransformer(LOCAL_EMBEDDING_MODEL, device="cuda", model_kwargs={"torch_dtype": torch.bfloat16})
+    return SentenceTransformer(LOCAL_EMBEDDING_MODEL, device="cpu")
+
+def _embed_locally(queries: List[str]) -> List[List[float]]:
+    """Embed queries with the local model, normalized like the API embeddings."""
+    vectors = _load_local_embedder().encode(queries, normalize_embeddings=True, convert_to_numpy=True)
+    return vectors.astype(np.float32).tolist()
+
+@functools.lru_cache(maxsize=1024)
+def _embed_query_locally(query: str) -> List[float]:
+    """Local counterpart of _embed_query, cached the same way."""
+    return _embed_locally([query])[0]
+
+@functools.lru_cache(maxsize=4096)
+def _tokenize_query(query: str):
+    """Tokenize a BM25 query once per distinct string; the result is only read by bm25s.retrieve."""
+    return bm25s.tokenize(query)
 
 class Retriever:
     """
@@ -12,7 +52,22 @@ class Retriever:
       - Create (and cache) a BM25 index and perform BM25 retrieval.
       - Fuse retrieval results and re-rank them.
     """
-    def __init__(self, client, chroma_client, contextual_chunks: List[str], collection, integrator: str = "together", base_name: str = "document", cache_dir: str = "cache"):
+    def __init__(
+            self, 
+            client, 
+            chroma_client, 
+            contextual_chunks: List[str], 
+            collection, 
+            integrator: str = "together", 
+            base_name: str = "document", 
+            cache_dir: str = "cache",
+            local_embedder: bool = False
+            ):
+        """
+        If local_embedder is True and the integrator is 'together', queries are embedded in-process
+        with LOCAL_EMBEDDING_MODEL instead of over the API. Other integrators store vectors from
+        different models, so for them the flag is ignored.
+        """
         self.client = client
         self.chroma_client = chroma_client
         self.contextual_chunks = contextual_chunks
@@ -23,22 +78,74 @@ class Retriever:
 
         os.makedirs(self.cache_dir, exist_ok=True)
         
-        self.bm25_cache = os.path.join(self.cache_dir, f"{self.base_name}_bm25.pkl")
+        # Indices-only BM25 index; the name differs from older corpus-backed caches so those are not reused.
+        self.bm25_cache = os.path.join(self.cache_dir, f"{self.base_name}_bm25_idx.pkl")
+        self.bm25_tokens_cache = self.bm25_cache + '.tok'
         self.bm25_index = None
+        # Both BM25 caches hold (chunks digest, value) pairs and are rebuilt when the digest differs.
+        self._chunks_digest = None
+
+        # Collection size, read once: the collection does not change after ingest.
+        self._collection_count = None
+
+        self.use_local_embedder = local_embedder and integrator == "together"
+        if local_embedder and not self.use_local_embedder:
+            print(f"[INFO] Local query embedder is only compatible with 'together' embeddings; using the {integrator} API.")
+
+    def _clamp_k(self, k: int) -> int:
+        """Clamp k to [1, collection size] so Chroma never pads results beyond the corpus."""
+        if self._collection_count is None:
+            self._collection_count = self.collection.count()
+        return max(1, min(k, self._collection_count))
 
     def _chroma_vector_retrieval(self, query: str, k: int = 10) -> List[int]:
         """
         Given a query, generate its embedding and query the Chroma collection.
         Returns a list of indices corresponding to the retrieved chunks.
         """
-        # Generate query embedding
-        query_embedding = generate_embeddings(self.client, [query], integrator=self.integrator)[0]
-        # Query the collection.
-        results = self.collection.query(query_embeddings=[query_embedding], n_results=k)
-        # Extract IDs assuming IDs are in the format "chunk_{index}".
-        ids = results["ids"][0]
-        indices = [int(id_.split("_")[1]) for id_ in ids]
-        return indices
+        k = self._clamp_k(k)
+        # Generate (or reuse) the query embedding
+        if self.use_local_embedder:
+            query_embedding = _embed_query_locally(query)
+        else:
+            query_embedding = _embed_query(self.client, query, self.integrator)
+        # Query the collection, returning only the small per-chunk metadata.
+        results = self.collection.query(query_embeddings=[query_embedding], n_results=k, include=["metadatas"])
+        return self._hit_indices(results["ids"][0], results["metadatas"][0])
+
+    def _chroma_vector_retrieval_batch(self, queries: List[str], k: int = 10) -> List[List[int]]:
+        """
+        Embed several queries in one embeddings call and query the Chroma collection once.
+        Returns one list of chunk indices per query, in the order of 'queries'.
+        """
+        k = self._clamp_k(k)
+        if self.use_local_embedder:
+            query_embeddings = _embed_locally(queries)
+        else:
+            query_embeddings = generate_embeddings(self.client, queries, integrator=self.integrator)
+        results = self.collection.query(query_embeddings=query_embeddings, n_results=k, include=["metadatas"])
+        return [self._hit_indices(ids, metadatas) for ids, metadatas in zip(results["ids"], results["metadatas"])]
+
+    @staticmethod
+    def _hit_indices(ids: List[str], metadatas: List[dict]) -> List[int]:
+        """
+        Map Chroma hits to chunk indices using the stored "idx" metadata.
+        Collections written before "idx" existed fall back to parsing "chunk_{index}" IDs.
+        """
+        return [
+            metadata["idx"] if metadata and "idx" in metadata else int(id_.split("_")[1])
+            for id_, metadata in zip(ids, metadatas)
+        ]
+
+    def _load_current(self, cache_path: str):
+        """Load a (digest, value) BM25 cache entry, returning None if it was built from other chunks."""
+        if self._chunks_digest is None:
+            self._chunks_digest = chunks_digest(self.contextual_chunks)
+        cached = load_from_cache(cache_path)
+        # Entries from before digests were stored are bare objects and are rebuilt too.
+        if isinstance(cached, tuple) and len(cached) == 2 and cached[0] == self._chunks_digest:
+            return cached[1]
+        return None
 
     def _create_bm25_index(self):
         """
@@ -46,8 +153,13 @@ class Retriever:
         """
         if not self.contextual_chunks:
             raise ValueError("No contextual chunks available for BM25 indexing.")
-        tokenized_corpus = bm25s.tokenize(self.contextual_chunks)
-        bm25_index = bm25s.BM25(corpus=self.contextual_chunks)
+        # Reuse the cached tokenization when it was made from these exact chunks.
+        tokenized_corpus = self._load_current(self.bm25_tokens_cache)
+        if tokenized_corpus is None:
+            tokenized_corpus = bm25s.tokenize(self.contextual_chunks)
+            save_to_cache((self._chunks_digest, tokenized_corpus), self.bm25_tokens_cache)
+        # Without a corpus attached, retrieve() returns document positions rather than texts.
+        bm25_index = bm25s.BM25()
         bm25_index.index(tokenized_corpus)
         return bm25_index
 
@@ -55,16 +167,9 @@ class Retriever:
         """
         Retrieve indices using BM25.
         """
-        results, _ = bm25_index.retrieve(bm25s.tokenize(query), k=k)
-        # Build a mapping from normalized chunk to its index for efficient lookup.
-        norm_chunks_map = {normalize(doc): idx for idx, doc in enumerate(self.contextual_chunks)}
-        
-        indices = []
-        for doc in results[0]:
-            norm_doc = normalize(doc)
-            if norm_doc in norm_chunks_map:
-                indices.append(norm_chunks_map[norm_doc])
-        return indices
+        results, _ = bm25_index.retrieve(_tokenize_query(query), k=k)
+        # Results are already integer positions into self.contextual_chunks.
+        return results[0].tolist()
 
     def _fuse_ranks(self, *rank_lists, K: int = 60) -> Tuple[List[Tuple[int, float]], List[int]]:
         """
@@ -74,12 +179,24 @@ class Retriever:
         - A list of tuples (document index, RRF score) sorted by score (highest first).
         - A list of document indices sorted by their RRF score.
         """
-        rrf_scores = defaultdict(float)
+        n = len(self.contextual_chunks)
+        scores = np.zeros(n)
+        # Position of each index's first appearance across the lists, in order; ties keep that order.
+        first_pos = np.full(n, np.iinfo(np.int64).max, dtype=np.int64)
+        offset = 0
         for rank_list in rank_lists:
-            for rank, doc_index in enumerate(rank_list, 1):
-                rrf_scores[doc_index] += 1 / (rank + K)
-        sorted_scores = sorted(rrf_scores.items(), key=lambda x: x[1], reverse=True)
-        return sorted_scores, [doc_index for doc_index, _ in sorted_scores]
+            if len(rank_list) == 0:
+                continue
+            indices = np.asarray(rank_list)
+            # add.at / minimum.at accumulate correctly even if a list repeats an index.
+            np.add.at(scores, indices, 1.0 / (np.arange(1, len(indices) + 1) + K))
+            np.minimum.at(first_pos, indices, np.arange(offset, offset + len(indices)))
+            offset += len(indices)
+        # lexsort keys are given least significant first: score descending, then first appearance.
+        order = np.lexsort((first_pos, -scores))
+        order = order[first_pos[order] < offset]
+        sorted_scores = [(int(i), float(scores[i])) for i in order]
+        return sorted_scores, order.tolist()
 
     def _rerank_documents(self, documents: List[str], query: str, top_n: int = 5) -> str:
         """
@@ -87,7 +204,7 @@ class Retriever:
         If self.integrator is 'openai', call rerank_documents_openai;
         otherwise, call rerank_documents_togetherai.
         """
-        if self.integrator.lower() == 'openai':
+        if self.integrator == 'openai':
             return rerank_documents_openai(self.client, documents, query, top_n)
         else:
             return rerank_documents_togetherai(self.client, documents, query, top_n)
@@ -99,11 +216,16 @@ class Retriever:
         """Public method for vector retrieval using Chroma."""
         return self._chroma_vector_retrieval(query, k)
 
+    def vector_retrieval_batch(self, queries: List[str], k: int = 8) -> List[List[int]]:
+        """Public method for vector retrieval of several queries at once."""
+        return self._chroma_vector_retrieval_batch(queries, k)
+
     def build_bm25_index(self):
         """Public method to build (or load) the BM25 index."""
-        self.bm25_index = load_from_cache(self.bm25_cache) or self._create_bm25_index()
-        if not load_from_cache(self.bm25_cache):
-            save_to_cache(self.bm25_index, self.bm25_cache)
+        self.bm25_index = self._load_current(self.bm25_cache)
+        if self.bm25_index is None:
+            self.bm25_index = self._create_bm25_index()
+            save_to_cache((self._chunks_digest, self.bm25_index), self.bm25_cache)
         return self.bm25_index
 
     def bm25_retrieval(self, query: str, k: int) -> List[int]:
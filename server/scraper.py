@@ -1,10 +1,45 @@
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+import importlib.util
 import os
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urljoin
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# BeautifulSoup uses the lxml C parser when it is installed.
+HTML_PARSER = 'lxml' if importlib.util.find_spec('lxml') is not None else 'html.parser'
+
+try:
+    # The lexbor backend; selectolax 1.0 dropped the older Modest-based selectolax.parser.
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:  # Fall back to BeautifulSoup for text extraction.
+    HTMLParser = None
+
+# Elements whose text makes up the article body, on both the selectolax and BeautifulSoup paths.
+# <li> and <article> are left out: they wrap navigation menus or the paragraphs already read.
+TEXT_TAGS = ('title', 'h1', 'h2', 'h3', 'p')
+TEXT_SELECTOR = ', '.join(TEXT_TAGS)
+
+# Only parse the tags each pass reads, instead of the whole DOM.
+IMAGE_STRAINER = SoupStrainer('img')
+TEXT_STRAINER = SoupStrainer(list(TEXT_TAGS))
+
+# (connect, read) timeouts in seconds for every request the scraper makes.
+REQUEST_TIMEOUT = (3, 10)
+# How many images to probe with HEAD when no candidate declares its dimensions.
+HEAD_PROBE_CANDIDATES = 3
 
 class Scraper:
     def __init__(self):
+        # One pooled session, so the page and image fetches reuse keep-alive connections.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=16, max_retries=Retry(total=2, backoff_factor=0.2))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
         self._tracking_domains = [
             "scorecardresearch.com",
             "doubleclick.net",
@@ -12,21 +47,45 @@ class Scraper:
             "adsystem.google.com",
             "analytics",
         ]
+        # One alternation over all domains: a single C-level scan per URL instead of a Python loop.
+        self._tracker_re = re.compile('|'.join(re.escape(domain) for domain in self._tracking_domains))
 
     def _is_tracking_image(self, image_url: str) -> bool:
-        return any(domain in image_url for domain in self._tracking_domains)
+        return bool(self._tracker_re.search(image_url))
+
+    def _content_length(self, image_url: str) -> int:
+        """Return the Content-Length reported by a HEAD request, or 0 if unavailable."""
+        try:
+            response = self.session.head(image_url, allow_redirects=True, timeout=REQUEST_TIMEOUT)
+            return int(response.headers.get('Content-Length', 0))
+        except (requests.RequestException, ValueError):
+            return 0
+
+    def _fetch_page(self, url: str) -> str:
+        """
+        Fetches the article HTML once so the image and text passes can share it.
+
+        Raises:
+            Exception: If the page cannot be fetched.
+        """
+        try:
+            response = self.session.get(url, timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+            return response.text
+        except requests.RequestException as e:
+            raise Exception(f"Page fetch failed: {e}")
 
-    def _scrape_image(self, url: str):
+    def _scrape_image(self, url: str, html: str):
         """
         Attempts to scrape the primary non-tracking image from the article and save it.
         The function iterates over all images, and if available, uses the width and height 
         attributes as a heuristic (area = width * height) to choose the largest one.
+        If no image declares its dimensions, the first few candidates are compared by
+        Content-Length via HEAD requests instead. Only the chosen image is downloaded.
         The image is saved as "articleImage.png" inside the /images folder.
         """
         try:
-            response = requests.get(url)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
+            soup = BeautifulSoup(html, HTML_PARSER, parse_only=IMAGE_STRAINER)
             
             candidates = []
             for img_tag in soup.find_all('img'):
@@ -56,17 +115,22 @@ class Scraper:
                 # Select the candidate with the maximum area.
                 best_candidate = max(candidates, key=lambda x: x[1])
                 best_image_url = best_candidate[0]
+                if best_candidate[1] == 0:
+                    # No usable dimensions; fall back to the largest file among the first candidates.
+                    probes = candidates[:HEAD_PROBE_CANDIDATES]
+                    best_image_url = max(probes, key=lambda x: self._content_length(x[0]))[0]
                 
                 # Save the image as articleImage.png in the /images folder.
                 image_folder = os.path.join(os.getcwd(), 'images')
                 os.makedirs(image_folder, exist_ok=True)
                 image_filename = os.path.join(image_folder, "articleImage.png")
                 
-                img_response = requests.get(best_image_url, stream=True)
+                img_response = self.session.get(best_image_url, stream=True, timeout=REQUEST_TIMEOUT)
                 img_response.raise_for_status()
+                # Copy the raw stream in 64 KB blocks, letting urllib3 undo any gzip/deflate encoding.
+                img_response.raw.decode_content = True
                 with open(image_filename, 'wb') as f:
-                    for chunk in img_response.iter_content(1024):
-                        f.write(chunk)
+                    shutil.copyfileobj(img_response.raw, f, length=65536)
                 print(f"Image saved as {image_filename}")
                 return  # Stop after saving the best candidate.
             else:
@@ -77,34 +141,73 @@ class Scraper:
             raise Exception(error_msg)
 
 
-    def _scrape_text(self, url: str):
+    def _extract_text_selectolax(self, html: str):
+        """Extract (title, text_snippets) with selectolax's C HTML parser."""
+        tree = HTMLParser(html)
+
+        # Extract title: Prefer <h1>, fall back to <title> tag.
+        title = ""
+        for selector in ('h1', 'title'):
+            node = tree.css_first(selector)
+            if node is not None and node.text(strip=True):
+                title = node.text(separator=' ', strip=True)
+                break
+
+        # Extract text snippets; the separator keeps words from adjacent inline nodes apart.
+        text_snippets = []
+        for node in tree.css(TEXT_SELECTOR):
+            # A node nested in another matched node is already part of that node's text.
+            parent = node.parent
+            while parent is not None and parent.tag not in TEXT_TAGS:
+                parent = parent.parent
+            if parent is not None:
+                continue
+            text = node.text(separator=' ', strip=True)
+            if text:
+                text_snippets.append(text)
+        return title, text_snippets
+
+    def _extract_text_bs4(self, html: str):
+        """Extract (title, text_snippets) with BeautifulSoup."""
+        soup = BeautifulSoup(html, HTML_PARSER, parse_only=TEXT_STRAINER)
+
+        # Extract title: Prefer <h1>, fall back to <title> tag.
+        title_tag = soup.find('h1')
+        if title_tag and title_tag.get_text(strip=True):
+            title = title_tag.get_text(separator=' ', strip=True)
+        elif soup.title:
+            title = soup.title.get_text(separator=' ', strip=True)
+        else:
+            title = ""
+
+        # Extract text snippets, one per outermost matched element as on the selectolax path.
+        text_snippets = []
+        for tag in soup.find_all(TEXT_TAGS):
+            if tag.find_parent(TEXT_TAGS) is not None:
+                continue
+            text = tag.get_text(separator=' ', strip=True)
+            if text:
+                text_snippets.append(text)
+        return title, text_snippets
+
+    def _scrape_text(self, html: str):
         """
-        Scrapes the article title and text snippets from the given URL.
+        Scrapes the article title and text snippets from the fetched article HTML,
+        using selectolax when installed and BeautifulSoup otherwise.
         
         Returns:
             tuple: (title, text_snippets)
                 title (str): The scraped <h1> title if available, otherwise the <title> text.
-                text_snippets (List[str]): A list of all stripped text strings from the article.
+                text_snippets (List[str]): The stripped text of each outermost title, heading and paragraph element.
         
         Raises:
             Exception: If the text scraping fails.
         """
         try:
-            response = requests.get(url)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Extract title: Prefer <h1>, fall back to <title> tag.
-            title_tag = soup.find('h1')
-            if title_tag and title_tag.get_text(strip=True):
-                title = title_tag.get_text(strip=True)
-            elif soup.title:
-                title = soup.title.get_text(strip=True)
+            if HTMLParser is not None:
+                title, text_snippets = self._extract_text_selectolax(html)
             else:
-                title = ""
-            
-            # Extract text snippets.
-            text_snippets = list(soup.stripped_strings)
+                title, text_snippets = self._extract_text_bs4(html)
             if not text_snippets:
                 raise ValueError("No text content found.")
             
@@ -113,18 +216,27 @@ class Scraper:
             raise Exception(f"Text scraping failed: {e}")
 
 
-    def scrape_article(self, url: str):
+    def scrape_article(self, url: str, scrape_image: bool = True):
         """
         Public method: Scrapes both the image (optional) and text (required) from the article.
+        The page is fetched once and both passes run concurrently on it.
+        Pass scrape_image=False to skip the image pass and its downloads entirely.
         Returns a dictionary with the article title and the full text (joined text snippets).
         """
-        print("Starting image scraping...")
-        image_result = self._scrape_image(url)
-        if isinstance(image_result, dict) and "error" in image_result:
-            return image_result
-        
-        print("Scraping text...")
-        title, text_snippets = self._scrape_text(url)
+        html = self._fetch_page(url)
+
+        if scrape_image:
+            # The image download is network-bound, so it runs alongside text extraction.
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                print("Starting image scraping...")
+                image_future = executor.submit(self._scrape_image, url, html)
+                print("Scraping text...")
+                text_future = executor.submit(self._scrape_text, html)
+                title, text_snippets = text_future.result()
+                image_future.result()
+        else:
+            print("Scraping text...")
+            title, text_snippets = self._scrape_text(html)
         
         # Join the text snippets into one full text.
         article_text = " ".join(text_snippets) if isinstance(text_snippets, list) else text_snippets